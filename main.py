@@ -1,37 +1,191 @@
 import argparse
 import obsidian_to_html.md_html as md_html
+import obsidian_to_html.static_files as static_files
+from obsidian_to_html.assets import (RETIRED_NAME, cache_control_for, fingerprint_assets, is_fingerprinted,
+                                     load_asset_manifest, retire_stale_assets)
+from obsidian_to_html.page_store import PageRecord, PageStore
+from obsidian_to_html.vault import NOTE, link_names, scan_vault
+from obsidian_to_html.live_reload import EVENTS_PATH, LiveReloadHub, inject_client_script, normalize_page
+from obsidian_to_html.lazy import LazyRenderer
+from obsidian_to_html.body_cache import BodyCache, default_cache_dir
+from obsidian_to_html.admission import ADMIN, BOOKING, STATIC, AdmissionControl, read_limits
+from obsidian_to_html import service_worker
 import os
 import hashlib
+import hmac
+import posixpath
+import math
 import time
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, SimpleHTTPRequestHandler, ThreadingHTTPServer
 import shutil
-from threading import Thread, Event
+from threading import Thread, Event, RLock
 import signal
 import sys
-from typing import Dict, Optional
+from typing import List, Optional
 import logging
 import configparser
 import json
 import cgi
 
+# Config sections read by the server only, changing them rewrites no pages
+SERVER_SECTIONS = {"security", "limits"}
 
-# workaround global variables for HTTPRequestHandler
-inpt_pth = ""
-outpt_pth = ""
-config_pth = ""
+# Admin routes look like /<command>-pw:<password>
+ADMIN_COMMANDS = ("rebuild-pages", "list-bookings", "flush-bookings", "admission-stats")
 
-request_passwd = ""
+class Site:
+    """One vault served by this process.
 
-class GracefulServer:
-    def __init__(self, output_path: str, md_path: str, config_path:str, file_ids: Dict, 
-                 ip: str = "localhost", port: int = 80):
-        self.output_path = output_path
+    Each site has its own output tree, config, admin password, page store and
+    caches. Requests are routed to it by Host header and/or path prefix.
+    """
+
+    def __init__(self, name: str, md_path: str, output_path: str, config_path: Optional[str] = None,
+                 host: Optional[str] = None, prefix: str = "", metadata_db: Optional[str] = None,
+                 lazy: bool = False, author: bool = False, booking_file: Optional[str] = None):
+        self.name = name
         self.md_path = md_path
+        self.output_path = os.path.abspath(output_path)
         self.config_path = config_path
-        self.file_ids = file_ids
+        self.host = host.lower() if host else None
+        self.prefix = "/" + prefix.strip("/") if prefix.strip("/") else ""
+        self.password = read_password(config_path)
+        # store booking requests one level above the output path, named after
+        # the site so sites whose outputs share a parent keep them apart
+        booking_name = "booking_requests.txt" if name == "default" else f"booking_requests-{name}.txt"
+        self.booking_file = booking_file or os.path.join(os.path.dirname(self.output_path), booking_name)
+
+        self.store = PageStore(metadata_db)
+        build_config = md_html.read_config(config_path)
+        self.body_cache: Optional[BodyCache] = None
+        if build_config.getboolean("build", "body_cache", fallback=True):
+            self.body_cache = BodyCache(default_cache_dir(self.output_path))
+        self.renderer: Optional[LazyRenderer] = None
+        if lazy:
+            cache_mb = build_config.getint("build", "lazy_cache_mb", fallback=64)
+            self.renderer = LazyRenderer(self.output_path, self.store, cache_mb * 1024 * 1024,
+                                         self.body_cache)
+        self.live_reload: Optional[LiveReloadHub] = LiveReloadHub() if author else None
+
+        # held by every build of this site, the watcher and admin rebuilds
+        # would otherwise wipe the output tree under each other
+        self.build_lock = RLock()
+
+        # what the watcher compares against, set by build()
+        self.config_file = md_html.config_file_path(config_path)
+        self.config_mtime = None
+        self.config_sections = {}
+        self.file_stats = {}
+
+    def matches(self, host, path):
+        if self.host is not None and self.host != host:
+            return False
+        if not self.prefix:
+            return True
+        path = path.split("?", 1)[0]
+        return path == self.prefix or path.startswith(self.prefix + "/")
+
+    def build(self, pool=None):
+        """Bring the output up to date at startup.
+
+        Only the changed notes are converted if the metadata db is still in
+        sync with the output directory, config, copied files and render mode.
+        """
+        with self.build_lock:
+            os.makedirs(self.output_path, exist_ok=True)
+            inventory = scan_vault(self.md_path)
+            if (len(self.store) and os.path.exists(os.path.join(self.output_path, "index.html"))
+                    and self.store.get_meta("mode") == render_mode(self.renderer)
+                    and self.store.get_meta("config") == config_fingerprint(self.config_path)
+                    and self.store.get_meta("files") == files_fingerprint(inventory)):
+                update_changed_md_files(self.output_path, self.md_path, self.config_path, self.store,
+                                        check_for_changes(inventory, self.store), inventory,
+                                        self.renderer, self.body_cache, pool)
+            else:
+                convert_all_md_files(self.output_path, self.md_path, self.config_path, self.store,
+                                     inventory, self.renderer, self.body_cache, pool)
+            self.file_stats = inventory.file_stats()
+            self.config_mtime = os.stat(self.config_file).st_mtime_ns
+            self.config_sections = read_config_sections(self.config_path)
+            self.prerender()
+
+    def prerender(self):
+        # lazy mode still renders the most visited notes up front
+        if self.renderer is not None:
+            config = md_html.read_config(self.config_path)
+            self.renderer.prerender(self.store.popular(config.getint("build", "eager_pages", fallback=20)))
+
+    def rebuild(self, pool=None, inventory=None):
+        with self.build_lock:
+            if inventory is None:
+                inventory = scan_vault(self.md_path)
+            convert_all_md_files(self.output_path, self.md_path, self.config_path, self.store,
+                                 inventory, self.renderer, self.body_cache, pool)
+            self.file_stats = inventory.file_stats()
+            self.prerender()
+            if self.live_reload is not None:
+                self.live_reload.publish_all()
+
+    def poll(self, pool=None, force_reload=False):
+        """Check the vault and config once and rebuild whatever changed."""
+        with self.build_lock:
+            inventory = scan_vault(self.md_path)
+
+            # Reload the config on SIGHUP or when the file was saved
+            config_mtime = os.stat(self.config_file).st_mtime_ns
+            if force_reload or config_mtime != self.config_mtime:
+                self.config_mtime = config_mtime
+                self.config_sections, changed = reload_config(self.output_path, self.md_path,
+                                                              self.config_path, self.store,
+                                                              self.config_sections, inventory,
+                                                              self.renderer, self.body_cache, pool)
+                self.password = read_password(self.config_path)
+                if self.live_reload is not None and changed - SERVER_SECTIONS:
+                    self.live_reload.publish_all()
+
+            # Check for changes in the vault, copied files change the
+            # fingerprints every page refers to so they need a full rebuild
+            if inventory.file_stats() != self.file_stats:
+                logging.info(f"[{self.name}] Images or attachments changed, rebuilding html files")
+                self.rebuild(pool, inventory)
+                return
+
+            changes = check_for_changes(inventory, self.store)
+            if any(changes):
+                logging.info(f"[{self.name}] Changes detected, updating html files")
+                changed_pages = update_changed_md_files(self.output_path, self.md_path, self.config_path,
+                                                        self.store, changes, inventory, self.renderer,
+                                                        self.body_cache, pool)
+                if self.live_reload is not None:
+                    self.live_reload.publish(changed_pages)
+
+def match_site(sites, host, path):
+    # a site bound to the Host header beats one that isn't, then the longest prefix wins
+    best = None
+    for site in sites:
+        if site.matches(host, path):
+            if best is None or (site.host is not None, len(site.prefix)) > (best.host is not None, len(best.prefix)):
+                best = site
+    return best
+
+class GracefulServer:
+    def __init__(self, sites: List[Site], ip: str = "localhost", port: int = 80,
+                 pool: Optional[ThreadPoolExecutor] = None,
+                 admission: Optional[AdmissionControl] = None,
+                 limits_file: Optional[str] = None):
+        self.sites = sites
         self.ip = ip
         self.port = port
+        self.pool = pool
+        self.admission = admission or AdmissionControl()
+        # file with the [limits] section, watched like the site configs
+        self.limits_file = limits_file
+        self.limits_mtime = os.stat(limits_file).st_mtime_ns if limits_file else None
+        # authoring mode polls the vaults more often to keep save-to-screen short
+        self.poll_interval = 0.2 if any(site.live_reload is not None for site in sites) else 1
         self.stop_event = Event()
+        self.reload_event = Event()
         self.httpd: Optional[HTTPServer] = None
         self.request_thread: Optional[Thread] = None
         
@@ -41,6 +195,8 @@ class GracefulServer:
         # Setup signal handlers
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.reload_handler)
 
     def setup_logging(self):
         logger = logging.getLogger()
@@ -63,10 +219,29 @@ class GracefulServer:
     def signal_handler(self, signum, frame):
         logging.info(f"Received signal {signum}. Shutting down gracefully...")
         self.stop_event.set()
+        for site in self.sites:
+            site.store.commit()
         if self.httpd:
             self.httpd.server_close()
         sys.exit(0)
 
+    def reload_handler(self, signum, frame):
+        # picked up by the main loop, the listening socket stays open
+        logging.info(f"Received signal {signum}. Reloading config...")
+        self.reload_event.set()
+
+    def reload_limits(self, force_reload=False):
+        if self.limits_file is None:
+            return
+        limits_mtime = os.stat(self.limits_file).st_mtime_ns
+        if not force_reload and limits_mtime == self.limits_mtime:
+            return
+        self.limits_mtime = limits_mtime
+        config = configparser.ConfigParser()
+        config.read(self.limits_file)
+        self.admission.configure(read_limits(config))
+        logging.info(f"Reloaded limits from {self.limits_file}")
+
     def handle_requests(self):
         while not self.stop_event.is_set():
             try:
@@ -78,15 +253,18 @@ class GracefulServer:
 
     def run(self):
         try:
-            os.chdir(self.output_path)
-        except Exception as e:
-            logging.error(f"Failed to change directory to {self.output_path}: {e}", 
-                         exc_info=True)
-            return
-
-        try:
-            self.httpd = HTTPServer((self.ip, self.port), CustomHTTPRequestHandler)
+            # one thread per connection, so open live reload streams
+            # don't block other requests
+            self.httpd = ThreadingHTTPServer((self.ip, self.port), CustomHTTPRequestHandler,
+                                             bind_and_activate=False)
+            # connections beyond the backlog wait in the kernel instead of threads
+            self.httpd.request_queue_size = self.admission.listen_backlog
+            self.httpd.server_bind()
+            self.httpd.server_activate()
             self.httpd.timeout = 1  # Set timeout for handle_request()
+            self.httpd.sites = self.sites
+            self.httpd.pool = self.pool
+            self.httpd.admission = self.admission
         except Exception as e:
             logging.error(f"Failed to start HTTP server on {self.ip}:{self.port}: {e}", 
                          exc_info=True)
@@ -94,6 +272,9 @@ class GracefulServer:
 
         logging.info(f"Serving HTTP on {self.ip} port {self.port} "
                     f"(http://{self.ip}:{self.port}/) ...")
+        for site in self.sites:
+            logging.info(f"Site {site.name}: host={site.host or '*'} prefix={site.prefix or '/'} "
+                         f"output={site.output_path}")
 
         self.request_thread = Thread(target=self.handle_requests)
         self.request_thread.daemon = True
@@ -107,14 +288,21 @@ class GracefulServer:
                 
                 # Log health check every 5 minutes
                 if current_time - last_health_check >= 300:  # 5 minutes
-                    logging.info("Server health check - Running")
+                    logging.info(f"Server health check - Running, admission: {self.admission.stats()}")
                     last_health_check = current_time
+                    # persist page view counts used to pick eagerly rendered notes
+                    for site in self.sites:
+                        site.store.commit()
                 
-                # Check for changes in md files
-                if check_for_changes(self.md_path, self.file_ids):
-                    logging.info("Changes detected, rebuilding html files")
-                    self.file_ids = convert_all_md_files(self.output_path, 
-                                                       self.md_path, self.config_path)
+                # One watcher for all vaults, a failing site doesn't stop the others
+                force_reload = self.reload_event.is_set()
+                self.reload_event.clear()
+                self.reload_limits(force_reload)
+                for site in self.sites:
+                    try:
+                        site.poll(self.pool, force_reload)
+                    except Exception as e:
+                        logging.error(f"Error updating site {site.name}: {e}", exc_info=True)
                 
                 # Verify request thread is still alive
                 if not self.request_thread.is_alive():
@@ -123,82 +311,236 @@ class GracefulServer:
                     self.request_thread.daemon = True
                     self.request_thread.start()
                 
-                time.sleep(1)
+                time.sleep(self.poll_interval)
                 
             except Exception as e:
                 logging.error(f"Error in main loop: {e}", exc_info=True)
                 time.sleep(1)  # Prevent tight loop in case of persistent errors
 
-def check_for_changes(md_path, file_ids):
-    new_file_ids = {}
-    for root, _, files in os.walk(md_path):
-        for file in files:
-            if file.endswith(".md"):
-                full_path_to_file = md_path + os.sep + file
-                new_file_ids[file] = generate_dynamic_id(full_path_to_file)
-    for key in file_ids:
-        if key not in new_file_ids:
-            print(f"File {key} has been deleted, rebuilding html files")
-            print(new_file_ids)
-            return True
-        if file_ids[key] != new_file_ids[key]:
-            print(f"File {key} has been modified, rebuilding html files")
-            return True
-    for key in new_file_ids:
-        if key not in file_ids:
-            print(f"File {key} has been added, rebuilding html files")
-            return True
-    return False
+def check_for_changes(inventory, store):
+    added, modified, deleted = store.changes(inventory.note_stats())
+    for key in deleted:
+        print(f"File {key} has been deleted, updating html files")
+    for key in modified:
+        print(f"File {key} has been modified, updating html files")
+    for key in added:
+        print(f"File {key} has been added, updating html files")
+    return added, modified, deleted
 
 class CustomHTTPRequestHandler(SimpleHTTPRequestHandler):
-    def end_headers(self):
-        # Check the file extension and set Content-Type accordingly
-        print("Path:", self.path)
-        if self.path.endswith(".css"):
-            self.send_header("Content-Type", "text/css; charset=utf-8")
-        elif self.path.endswith(".js"):
-            self.send_header("Content-Type", "text/javascript; charset=utf-8")
+    site: Site
+
+    def setup(self):
+        # read and idle timeout for the connection socket
+        self.timeout = self.server.admission.timeout
+        super().setup()
+
+    def send_text(self, status, text, content_type="text/plain; charset=utf-8"):
+        body = bytes(text, "utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_rejection(self, status, retry_after):
+        body = b"Too Many Requests" if status == 429 else b"Service Unavailable"
+        self.send_response(status)
+        self.send_header("Retry-After", str(math.ceil(retry_after)))
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+        # an unread request body would be taken for the next request
+        self.close_connection = True
+
+    def is_prefetch(self):
+        # prefetch hints, speculation rules and the service worker's precache
+        # fetch pages nobody may look at, they aren't counted as views
+        for header in ("Sec-Purpose", "Purpose", "X-Purpose", "X-Moz"):
+            if "prefetch" in (self.headers.get(header) or "").lower():
+                return True
+        return False
+
+    def send_redirect(self, location):
+        self.send_response(301)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def route(self):
+        """Pick the site for this request and strip its path prefix.
+
+        Returns False if the request was already answered.
+        """
+        host = (self.headers.get("Host") or "").split(":", 1)[0].lower()
+        site = match_site(self.server.sites, host, self.path)
+        if site is None:
+            self.send_text(404, "Not Found")
+            return False
+        self.site = site
+        self.directory = site.output_path
+        if site.prefix:
+            rest = self.path[len(site.prefix):]
+            if not rest or rest.startswith("?"):
+                self.send_redirect(site.prefix + "/" + rest)
+                return False
+            self.path = rest
+        return True
+
+    def send_html(self, html, head_only=False):
+        if self.site.live_reload is not None:
+            # authoring mode: never cache pages and let them listen for rebuilds
+            html = inject_client_script(html, self.site.prefix)
+            cache_control = "no-cache"
         else:
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-        super().end_headers()
-    
-    def do_GET(self):
-        if self.path == f"/rebuild-pages-pw:{request_passwd}":
-            convert_all_md_files(outpt_pth, inpt_pth, config_pth)
+            cache_control = cache_control_for(".html")
+        body = bytes(html, "utf-8", "xmlcharrefreplace")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", cache_control)
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(body)
+
+    def serve_static(self, head_only=False):
+        if self.site.live_reload is not None and self.path.split("?", 1)[0] == "/" + service_worker.SW_NAME:
+            # authoring mode: replace any installed worker so edits show up at once
+            body = bytes(service_worker.UNREGISTER_SCRIPT, "utf-8")
             self.send_response(200)
+            self.send_header("Content-Type", "text/javascript; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-cache")
             self.end_headers()
-            self.wfile.write(b"Pages rebuilt")
+            if not head_only:
+                self.wfile.write(body)
+            return
+
+        if self.site.renderer is not None:
+            # lazy mode: notes are rendered on their first request
+            html = self.site.renderer.get(normalize_page(self.path), count_hit=not self.is_prefetch())
+            if html is not None:
+                self.send_html(html, head_only)
+                return
+
+        fs_path = self.translate_path(self.path)
+        if os.path.isdir(fs_path):
+            path, _, query = self.path.partition("?")
+            if not path.endswith("/"):
+                self.send_redirect(self.site.prefix + path + "/" + ("?" + query if query else ""))
+                return
+            index_path = os.path.join(fs_path, "index.html")
+            if not os.path.isfile(index_path):
+                # keep the stock directory listing behaviour
+                if head_only:
+                    super().do_HEAD()
+                else:
+                    super().do_GET()
+                return
+            fs_path = index_path
+        if self.site.live_reload is not None and fs_path.endswith(".html"):
+            try:
+                with open(fs_path, "r", encoding="utf-8") as f:
+                    html = f.read()
+            except OSError:
+                self.send_error(404, "File not found")
+                return
+            self.send_html(html, head_only)
+            return
+        extra_headers = {"Cache-Control": cache_control_for(self.path.split("?", 1)[0])}
+        static_files.send_static_file(self, fs_path, head_only, extra_headers)
+
+    def route_class(self):
+        path = self.path.split("?", 1)[0]
+        if path.startswith(tuple(f"/{command}-pw:" for command in ADMIN_COMMANDS)):
+            return ADMIN
+        if path == "/submit-booking":
+            return BOOKING
+        return STATIC
+
+    def admin_command(self):
+        """Return the admin command in the path if it carries the right password."""
+        for command in ADMIN_COMMANDS:
+            prefix = f"/{command}-pw:"
+            if self.path.startswith(prefix):
+                # constant time, so the password can't be guessed byte by byte
+                given = self.path[len(prefix):].encode("utf-8")
+                if hmac.compare_digest(given, self.site.password.encode("utf-8")):
+                    return command
+                logging.warning(f"Wrong admin password from {self.client_address[0]}")
+                self.server.admission.failed_login(self.client_address[0])
+                return None
+        return None
+
+    def admit(self, serve):
+        """Route the request and run serve if admission control lets it through."""
+        if not self.route():
             return
-        if self.path == f"/list-bookings-pw:{request_passwd}":
-            booking_file_path = os.path.join(os.path.dirname(outpt_pth), "booking_requests.txt")
-            if os.path.exists(booking_file_path):
-                with open(booking_file_path, "r") as f:
+        admission = self.server.admission
+        ip = self.client_address[0]
+        site = self.site
+        if site.live_reload is not None and self.path.split("?", 1)[0] == EVENTS_PATH:
+            # event streams stay open as long as the page, they don't count
+            # against the in-flight limit
+            wait = admission.check_rate(STATIC, ip)
+            if wait:
+                self.send_rejection(429, wait)
+                return
+            site.live_reload.stream(self, site.prefix)
+            return
+        if not admission.enter():
+            self.send_rejection(503, admission.retry_after)
+            return
+        try:
+            wait = admission.check_rate(self.route_class(), ip)
+            if wait:
+                self.send_rejection(429, wait)
+                return
+            serve()
+        finally:
+            admission.leave()
+
+    def do_GET(self):
+        self.admit(self.serve_get)
+
+    def serve_get(self):
+        site = self.site
+        command = self.admin_command()
+        if command == "rebuild-pages":
+            site.rebuild(self.server.pool)
+            self.send_text(200, "Pages rebuilt")
+            return
+        if command == "list-bookings":
+            if os.path.exists(site.booking_file):
+                with open(site.booking_file, "r") as f:
                     bookings = f.read()
-                self.send_response(200)
-                self.send_header('Content-Type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(bytes(bookings, 'utf-8'))
+                self.send_text(200, bookings)
             else:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"No booking requests found")
+                self.send_text(404, "No booking requests found")
             return
-        if self.path == f"/flush-bookings-pw:{request_passwd}":
-            booking_file_path = os.path.join(os.path.dirname(outpt_pth), "booking_requests.txt")
-            if os.path.exists(booking_file_path):
-                os.remove(booking_file_path)
-                self.send_response(200)
-                self.end_headers()
-                self.wfile.write(b"Booking requests flushed")
+        if command == "flush-bookings":
+            if os.path.exists(site.booking_file):
+                os.remove(site.booking_file)
+                self.send_text(200, "Booking requests flushed")
             else:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"No booking requests found")
+                self.send_text(404, "No booking requests found")
+            return
+        if command == "admission-stats":
+            self.send_text(200, json.dumps(self.server.admission.stats(), sort_keys=True),
+                           "application/json")
             return
         else:
-            super().do_GET()  
+            self.serve_static()
+
+    def do_HEAD(self):
+        self.admit(lambda: self.serve_static(head_only=True))
     
     def do_POST(self):
+        self.admit(self.serve_post)
+
+    def serve_post(self):
         if self.path == "/submit-booking":
             ctype, pdict = cgi.parse_header(self.headers.get('Content-Type'))
             if ctype == 'multipart/form-data':
@@ -214,9 +556,8 @@ class CustomHTTPRequestHandler(SimpleHTTPRequestHandler):
                 # Process the form data as needed
                 print(f"Received booking request from {name} ({email}) for dates {dates} with {guests} guests.")
 
-                # store booking request in a file one level above the output path
-                booking_file_path = os.path.join(os.path.dirname(outpt_pth), "booking_requests.txt")
-                with open(booking_file_path, "a") as f:
+                # store booking request in the site's booking file
+                with open(self.site.booking_file, "a") as f:
                     f.write(f"Name: {name}, Email: {email}, Dates: {dates}, Guests: {guests}\n")
                 
                 # Send a JSON response
@@ -229,117 +570,372 @@ class CustomHTTPRequestHandler(SimpleHTTPRequestHandler):
                 }
                 self.wfile.write(bytes(json.dumps(response), 'utf-8'))
             else:
-                self.send_response(400)
-                self.end_headers()
-                self.wfile.write(b"Invalid form data")
+                self.send_text(400, "Invalid form data")
         else:
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(b"Not Found")
+            self.send_text(404, "Not Found")
 
-def serve_output_html(output_path, md_path, file_ids, ip="localhost", port=80, config_path=None):
-    server = GracefulServer(output_path, md_path, config_path, file_ids, ip, port)
+def serve_sites(sites, ip="localhost", port=80, pool=None, admission=None, limits_file=None):
+    server = GracefulServer(sites, ip, port, pool, admission, limits_file)
     server.run()
 
+def load_sites(sites_path, lazy=False, author=False):
+    """Read the [site:<name>] sections of a sites file into Site objects."""
+    sites_config = configparser.ConfigParser()
+    if not sites_config.read(sites_path):
+        raise FileNotFoundError(f"Sites file {sites_path} not found")
+    sites = []
+    for section in sites_config.sections():
+        if not section.startswith("site:"):
+            continue
+        options = sites_config[section]
+        sites.append(Site(
+            section[len("site:"):], options["vault"], options["output"], options.get("config"),
+            host=options.get("host"), prefix=options.get("prefix", ""),
+            metadata_db=options.get("metadata_db"),
+            lazy=options.getboolean("lazy", fallback=lazy),
+            author=options.getboolean("author", fallback=author),
+            booking_file=options.get("bookings"),
+        ))
+    return sites, sites_config
 
-def generate_dynamic_id(file_path):
-    mtime = os.path.getmtime(file_path)
-    hash_input = f"{file_path}-{mtime}".encode('utf-8')
-    return hashlib.md5(hash_input).hexdigest()
 
-def convert_all_md_files(output_path, input_path, config_path=None):
+def read_password(config_path):
+    # load password from security section of config file
+    if config_path:
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        return config["security"]["password"]
+    return "password"
+
+def read_config_sections(config_path):
+    config = md_html.read_config(config_path)
+    return {section: dict(config[section]) for section in config.sections()}
+
+def config_fingerprint(config_path):
+    # only the sections that end up in the pages
+    sections = {name: values for name, values in read_config_sections(config_path).items()
+                if name not in SERVER_SECTIONS}
+    return hashlib.sha256(json.dumps(sections, sort_keys=True).encode("utf-8")).hexdigest()
+
+def render_mode(renderer):
+    # an eager build writes every page, a lazy one only indexes the notes
+    return "eager" if renderer is None else "lazy"
+
+def files_fingerprint(inventory):
+    stats = sorted(inventory.file_stats().items())
+    return hashlib.sha256(json.dumps(stats).encode("utf-8")).hexdigest()
+
+def render_md_file(entry, store, body_cache=None):
+    print("Converting", entry.path)
+    if body_cache is not None:
+        body, tags = body_cache.render(entry)
+    else:
+        body, tags = md_html.render_body(entry.path)
+    links = md_html.link_keys(body, posixpath.dirname(entry.source))
+    store.upsert(PageRecord(entry.source, entry.output, tags, entry.ctime, entry.mtime_ns, entry.size, links))
+    return body
+
+def write_md_page(entry, body, output_path, config, links, hidden):
+    md_html.write_page(output_path, entry.output, md_html.wrap_page(body, config, links, entry.output, hidden))
+
+def convert_md_files(entries, output_path, config, links, store, body_cache=None, pool=None):
+    """Convert notes in two passes, so every page knows the tags of all notes
+    before it picks the linked notes to prefetch.
+    """
+    entries = list(entries)
+    if pool is None:
+        bodies = [render_md_file(entry, store, body_cache) for entry in entries]
+    else:
+        bodies = list(pool.map(render_md_file, entries, [store] * len(entries), [body_cache] * len(entries)))
+
+    hidden = md_html.hidden_pages(store)
+    if pool is None:
+        for entry, body in zip(entries, bodies):
+            write_md_page(entry, body, output_path, config, links, hidden)
+        return
+    futures = [pool.submit(write_md_page, entry, body, output_path, config, links, hidden)
+               for entry, body in zip(entries, bodies)]
+    # wait for every note and raise the first error, if any
+    for future in futures:
+        future.result()
+
+def hidden_sources(store):
+    return {record.source for record in store.pages_with_tag(md_html.HIDDEN_TAG)}
+
+def relinked_notes(inventory, store, moved, skip):
+    """Notes not in skip that link to any of the notes in moved.
+
+    moved are sources of notes that came, went or were (un)hidden, the notes
+    linking to any of their names are found through the store's link index.
+    """
+    keys = {name for source in moved for name in link_names(source, NOTE)}
+    return [inventory.notes[source] for source in store.linking_to(keys)
+            if source not in skip and source in inventory.notes]
+
+def index_md_file(entry, store):
+    # lazy mode: only read the tags for the home page, render on request
+    record = store.get(entry.source)
+    if record is not None and (record.mtime_ns, record.size) == entry.stat_key:
+        return
+    tags = md_html.read_tags(entry.path)
+    store.upsert(PageRecord(entry.source, entry.output, tags, entry.ctime, entry.mtime_ns, entry.size))
+
+def update_changed_md_files(output_path, input_path, config_path, store, changes, inventory=None,
+                            renderer=None, body_cache=None, pool=None):
+    """Convert only added and modified notes and drop deleted ones.
+
+    Unchanged notes that link to a note that was added, moved or
+    deleted are wrapped again too, so their links point at the new target,
+    and so are notes linking to one that was hidden or unhidden, so their
+    prefetch hints leave hidden notes out. With a lazy renderer, changed notes are only re-indexed and their stale
+    pages removed, they are rendered again on their next request. Returns the
+    output names of all pages that were rewritten or removed.
+    """
+    added, modified, deleted = changes
+    if inventory is None:
+        inventory = scan_vault(input_path)
+    config = md_html.read_config(config_path)
+    assets = load_asset_manifest(output_path)
+    links = inventory.link_targets(assets)
+    if renderer is not None:
+        renderer.update(inventory, links, config, config_fingerprint(config_path))
+
+    hidden_before = hidden_sources(store)
+    changed_pages = ["index.html"]
+    for source in deleted:
+        if body_cache is not None:
+            body_cache.discard(os.path.join(input_path, *source.split("/")))
+        record = store.remove(source)
+        if record is not None:
+            changed_pages.append(record.name)
+            html_path = os.path.join(output_path, *record.name.split("/"))
+            if os.path.exists(html_path):
+                os.remove(html_path)
+
+    entries = [inventory.notes[source] for source in added + modified]
+    if renderer is None:
+        entries += relinked_notes(inventory, store, added + deleted, set(added + modified))
+        convert_md_files(entries, output_path, config, links, store, body_cache, pool)
+        # tags are only known once the changed notes are converted
+        flipped = hidden_before ^ hidden_sources(store)
+        if flipped:
+            relinked = relinked_notes(inventory, store, flipped, {entry.source for entry in entries})
+            convert_md_files(relinked, output_path, config, links, store, body_cache, pool)
+            entries += relinked
+    else:
+        for entry in entries:
+            index_md_file(entry, store)
+            renderer.discard(entry.output)
+            html_path = os.path.join(output_path, *entry.output.split("/"))
+            if os.path.exists(html_path):
+                os.remove(html_path)
+        # lazily indexed notes have no link index, drop every cached page
+        if hidden_before != hidden_sources(store):
+            renderer.clear()
+    changed_pages += [entry.output for entry in entries]
+
+    # regenerate the home page from the store
+    md_html.generate_home_page(store.sorted_pages(), output_path, config_path, assets)
+    write_service_worker(output_path, config, store, assets)
+    store.commit()
+    return changed_pages
+
+def copy_vault_file(entry, output_path):
+    destination = os.path.join(output_path, *entry.output.split("/"))
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    shutil.copy(entry.path, destination)
+
+def write_style_assets(output_path, config, inventory):
+    """Write the stylesheets and chrome files and fingerprint all assets.
+
+    Returns the asset manifest, empty if fingerprinting is off.
+    """
+    md_html.copy_style_files(output_path)
+    md_html.generate_opa_css(config, output_path)
+    chrome_files = md_html.write_chrome_files(output_path, config)
+
+    # fingerprint stylesheets, icon and images so they can be cached forever
+    if not config.getboolean("build", "fingerprint", fallback=True):
+        retire_stale_assets(output_path, {})
+        return {}
+    image_files = [entry.output for entry in inventory.images.values()]
+    asset_files = ["styles/github.css", "styles/opa.css", "icon.png"] + chrome_files + image_files
+    return fingerprint_assets(output_path, asset_files)
+
+def write_service_worker(output_path, config, store, assets):
+    # precache the newest visible notes along with the home page and styles
+    if not config.getboolean("build", "service_worker", fallback=True):
+        return
+    count = config.getint("build", "precache_notes", fallback=10)
+    pages = [record.name for record in store.sorted_pages() if not md_html.is_hidden(record)][:count]
+    service_worker.write_service_worker(output_path, service_worker.precache_urls(output_path, assets, pages))
+
+def rewrap_all_pages(output_path, input_path, config_path, store, inventory=None, renderer=None,
+                     body_cache=None, pool=None):
+    """Regenerate the styles and wrap every page in fresh chrome.
+
+    Bodies come from body_cache, so only notes that changed since they were
+    cached go through the Markdown pipeline again.
+    """
+    if inventory is None:
+        inventory = scan_vault(input_path)
+    config = md_html.read_config(config_path)
+    assets = write_style_assets(output_path, config, inventory)
+    links = inventory.link_targets(assets)
+
+    if renderer is not None:
+        renderer.update(inventory, links, config, config_fingerprint(config_path))
+    else:
+        convert_md_files(inventory.notes.values(), output_path, config, links, store, body_cache, pool)
+
+    md_html.generate_home_page(store.sorted_pages(), output_path, config_path, assets)
+    write_service_worker(output_path, config, store, assets)
+    store.set_meta("config", config_fingerprint(config_path))
+    store.commit()
+
+def reload_config(output_path, input_path, config_path, store, previous_sections, inventory=None,
+                  renderer=None, body_cache=None, pool=None):
+    """Apply a changed config without restarting the server.
+
+    Only [security] or [limits] changed: nothing is rebuilt, the caller
+    reloads the admin password and the server its limits. Only [style] changed, stylesheets are not fingerprinted and the
+    chrome styles live in a shared file: the stylesheets are regenerated in
+    place and pages are left alone. Anything else re-wraps the
+    cached page bodies. Returns the new config sections and the names of the
+    sections that changed.
+    """
+    sections = read_config_sections(config_path)
+    changed = {name for name in set(sections) | set(previous_sections)
+               if sections.get(name) != previous_sections.get(name)}
+    if not changed:
+        return sections, changed
+
+    logging.info(f"Config sections changed: {', '.join(sorted(changed))}")
+    if changed <= SERVER_SECTIONS:
+        return sections, changed
+
+    config = md_html.read_config(config_path)
+    # pages inline the chrome styles, which use [style], unless they are shared
+    if (changed <= {"style"} | SERVER_SECTIONS and not config.getboolean("build", "fingerprint", fallback=True)
+            and config.getboolean("build", "shared_chrome", fallback=True)):
+        if inventory is None:
+            inventory = scan_vault(input_path)
+        write_service_worker(output_path, config, store, write_style_assets(output_path, config, inventory))
+        store.set_meta("config", config_fingerprint(config_path))
+        store.commit()
+    else:
+        rewrap_all_pages(output_path, input_path, config_path, store, inventory, renderer, body_cache,
+                         pool)
+    return sections, changed
+
+def convert_all_md_files(output_path, input_path, config_path=None, store=None, inventory=None,
+                         renderer=None, body_cache=None, pool=None):
     print("Converting all md files to html")
     print("Input path:", input_path)
     print("Output path:", output_path)
-    # remove all files in output path
-    for root, _, files in os.walk(output_path, topdown=False):
+    # remove all files and folders in output path, except older fingerprinted
+    # assets that cached pages may still load, write_style_assets retires them
+    for root, dirs, files in os.walk(output_path, topdown=False):
         for file in files:
-            file_path = os.path.join(output_path, file)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            if not is_fingerprinted(file) and file != RETIRED_NAME:
+                os.remove(os.path.join(root, file))
+        for directory in dirs:
+            directory_path = os.path.join(root, directory)
+            if not os.listdir(directory_path):
+                os.rmdir(directory_path)
+
+    # scan the vault once, every step below works off this inventory
+    if inventory is None:
+        inventory = scan_vault(input_path)
     
-    # Convert all md files to html
-    file_dynamic_ids = {}
-    pages = []
-    for root, _, files in os.walk(input_path):
-        for file in files:
-            if file.endswith(".md"):
-                full_path_to_file = input_path + os.sep + file
-                print("Converting", full_path_to_file)
-                
-                html_file_name, tags = md_html.md_to_html(full_path_to_file, output_path, config_path)
-
-                md_file_creation_time = os.path.getctime(full_path_to_file)
-                md_file_creation_date = time.strftime('%d.%m.%Y', time.localtime(md_file_creation_time))
-                pages.append({"name": html_file_name, "tags": tags, "date": md_file_creation_date, "time": md_file_creation_time})
-                
-                file_dynamic_ids[file] = generate_dynamic_id(full_path_to_file)
-
-    # sort pages by most recent date
-    pages.sort(key=lambda x: x["time"], reverse=True)
-
-    # generate home page
-    md_html.generate_home_page(pages, output_path, config_path)
-
     # copy icon.png to output path
     icon_path = os.path.join(os.path.dirname(__file__), "icon.png")
     if os.path.exists(icon_path):
         shutil.copy(icon_path, output_path)
 
-    # copy all images to output path
-    for root, _, files in os.walk(input_path):
-        if root == input_path:  # Only process files in the root directory
-            for file in files:
-                if file.endswith(".png") or file.endswith(".jpg") or file.endswith(".jpeg"):
-                    full_path_to_file = os.path.join(root, file)
-                    shutil.copy(full_path_to_file, output_path)
-
-    # copy input_path/pages folder to output_path/pages
-    pages_path = os.path.join(output_path, "pages")
-    src_pages_path = os.path.join(input_path, "pages")
-    if os.path.exists(pages_path):
-        shutil.rmtree(pages_path)
-    if os.path.exists(src_pages_path):
-        shutil.copytree(src_pages_path, pages_path)
-        print(f"Copied pages folder from {src_pages_path} to {pages_path}")
-    else:
-        print(f"Source pages folder {src_pages_path} does not exist")
+    # copy all images to output path, keeping their folders
+    for entry in inventory.images.values():
+        copy_vault_file(entry, output_path)
 
+    # copy everything in input_path/pages to output_path/pages as-is
+    for entry in inventory.attachments.values():
+        copy_vault_file(entry, output_path)
+    print(f"Copied {len(inventory.images)} images and {len(inventory.attachments)} attachments")
 
     # add style files
-    md_html.copy_style_files(output_path)
-
-    return file_dynamic_ids
+    config = md_html.read_config(config_path)
+    assets = write_style_assets(output_path, config, inventory)
+    links = inventory.link_targets(assets)
+
+    # Convert all md files to html, or only index them in lazy mode
+    if store is None:
+        store = PageStore()
+    if renderer is None:
+        convert_md_files(inventory.notes.values(), output_path, config, links, store, body_cache, pool)
+    else:
+        for entry in inventory.notes.values():
+            index_md_file(entry, store)
+    for source in store.sources():
+        if source not in inventory.notes:
+            store.remove(source)
+    # drop bodies of notes deleted or renamed since the cache was filled
+    if body_cache is not None:
+        body_cache.prune(inventory.notes.values())
+
+    # generate home page, sorted by most recent date
+    md_html.generate_home_page(store.sorted_pages(), output_path, config_path, assets)
+
+    store.set_meta("config", config_fingerprint(config_path))
+    store.set_meta("files", files_fingerprint(inventory))
+    store.set_meta("mode", render_mode(renderer))
+    store.commit()
+
+    if renderer is not None:
+        renderer.update(inventory, links, config, config_fingerprint(config_path))
+    write_service_worker(output_path, config, store, assets)
+    return store
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert markdown file to html and maintain a directory of html files to serve as a website")
     # add arguments for md input file directory and output dir
-    parser.add_argument("md", help="Markdown files to convert to html")
-    parser.add_argument("output", help="Output directory for html files")
-    parser.add_argument("ip", help="IP address to serve the html files on", default="localhost")
-    parser.add_argument("port", type=int, help="Port to serve the html files on", default=80)
+    parser.add_argument("md", nargs="?", help="Markdown files to convert to html")
+    parser.add_argument("output", nargs="?", help="Output directory for html files")
+    parser.add_argument("ip", nargs="?", help="IP address to serve the html files on", default="localhost")
+    parser.add_argument("port", nargs="?", type=int, help="Port to serve the html files on", default=80)
     # TODO: add optional argument for config file and add pw to config
     parser.add_argument("--config", help="Config file for html conversion and security")
+    parser.add_argument("--metadata-db", help="SQLite file to keep page metadata in between runs")
+    parser.add_argument("--author", action="store_true",
+                        help="Authoring mode: open pages reload themselves when their note changes")
+    parser.add_argument("--lazy", action="store_true",
+                        help="Render notes on their first request instead of all at startup")
+    parser.add_argument("--sites", help="Sites file listing several vaults to host from this process")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Size of the conversion worker pool shared by all sites")
     args = parser.parse_args()
-    
-    md_path = args.md
-    output_path = args.output
-    config_path = args.config
-
-    inpt_pth = md_path
-    outpt_pth = output_path
-    config_pth = config_path
 
-    # load password from security section of config file
-    if config_path:
-        config = configparser.ConfigParser()
-        config.read(config_path)
-        request_passwd = config["security"]["password"]
+    ip, port, workers = args.ip, args.port, args.workers
+    if args.sites:
+        sites, sites_config = load_sites(args.sites, args.lazy, args.author)
+        if sites_config.has_section("server"):
+            ip = sites_config["server"].get("ip", ip)
+            port = sites_config["server"].getint("port", port)
+            workers = sites_config["server"].getint("workers", workers)
+        # one set of limits for the whole server
+        admission = AdmissionControl.from_config(sites_config)
+        limits_file = args.sites
     else:
-        request_passwd = "password"
+        if not args.md or not args.output:
+            parser.error("md and output are required unless --sites is given")
+        sites = [Site("default", args.md, args.output, args.config, metadata_db=args.metadata_db,
+                      lazy=args.lazy, author=args.author)]
+        admission = AdmissionControl.from_config(md_html.read_config(args.config))
+        limits_file = md_html.config_file_path(args.config)
 
     # convert md files to html
-    ids = convert_all_md_files(output_path, md_path, config_path)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    for site in sites:
+        site.build(pool)
 
     # serve html files
-    serve_output_html(output_path, md_path, ids, args.ip, args.port, config_path)
+    serve_sites(sites, ip, port, pool, admission, limits_file)
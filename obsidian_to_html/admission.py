@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import Counter
+
+ADMIN = "admin"
+BOOKING = "booking"
+STATIC = "static"
+
+# Defaults for the [limits] section, rates are requests per second per IP
+DEFAULT_LIMITS = {
+    "max_in_flight": 64,
+    "listen_backlog": 64,
+    "retry_after": 5,
+    "timeout": 10,
+    "admin_rate": 0.2,
+    "admin_burst": 3,
+    "booking_rate": 0.05,
+    "booking_burst": 5,
+    "static_rate": 20,
+    "static_burst": 100,
+    "admin_failures": 5,
+    "admin_failure_window": 600,
+}
+
+# Buckets are dropped once there are this many and they have been idle long
+# enough to be full again
+MAX_BUCKETS = 10000
+
+def read_limits(config, section="limits"):
+    """The [limits] values set in config, missing ones fall back to DEFAULT_LIMITS."""
+    if config is None or not config.has_section(section):
+        return {}
+    return {key: config[section][key] for key in DEFAULT_LIMITS if key in config[section]}
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+
+class RateLimiter:
+    """Per-IP token buckets that refill at rate tokens per second up to burst."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def _refill(self, bucket, now):
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+
+    def _prune(self, now):
+        idle = self.burst / self.rate if self.rate > 0 else float("inf")
+        self._buckets = {ip: bucket for ip, bucket in self._buckets.items()
+                         if now - bucket.updated < idle}
+
+    def allow(self, ip, now=None):
+        """Take a token for ip, returns 0 if allowed or the seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(ip)
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._prune(now)
+                bucket = self._buckets[ip] = TokenBucket(self.burst, now)
+            self._refill(bucket, now)
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return 0
+            if self.rate <= 0:
+                return float("inf")
+            return (1 - bucket.tokens) / self.rate
+
+    def blocked(self, ip, now=None):
+        """Like allow, but only checks whether a token is left without taking it."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(ip)
+            if bucket is None:
+                return False
+            self._refill(bucket, now)
+            return bucket.tokens < 1
+
+class AdmissionControl:
+    """Decides whether a request is served, shed or rate limited.
+
+    At most max_in_flight requests are handled at once, anything beyond that
+    gets a 503. Each route class has its own per-IP rate limit, answered with
+    a 429. Failed admin passwords use up a separate, slowly refilling bucket,
+    once it is empty the IP can't reach the admin routes for a while.
+    """
+
+    def __init__(self, limits=None):
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.counters = Counter()
+        self.failures = None
+        self.configure(limits)
+
+    def configure(self, limits=None):
+        """Apply new limits, counters and requests in flight are kept.
+
+        The listen backlog only takes effect when the server socket is opened.
+        """
+        limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        limiters = {
+            route_class: RateLimiter(float(limits[f"{route_class}_rate"]),
+                                     float(limits[f"{route_class}_burst"]))
+            for route_class in (ADMIN, BOOKING, STATIC)
+        }
+        failures = float(limits["admin_failures"])
+        with self._lock:
+            self.max_in_flight = int(limits["max_in_flight"])
+            self.listen_backlog = int(limits["listen_backlog"])
+            self.retry_after = int(limits["retry_after"])
+            self.timeout = float(limits["timeout"])
+            self.limiters = limiters
+            # keep the lockouts of IPs that guessed admin passwords
+            if self.failures is None or self.failures.burst != failures:
+                self.failures = RateLimiter(failures / float(limits["admin_failure_window"]), failures)
+
+    @classmethod
+    def from_config(cls, config, section="limits"):
+        return cls(read_limits(config, section))
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def enter(self):
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                self.counters["rejected_busy"] += 1
+                return False
+            self._in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def check_rate(self, route_class, ip):
+        """Return 0 if ip may make a route_class request, else seconds to wait."""
+        if route_class == ADMIN and self.failures.blocked(ip):
+            self.count("rejected_admin_locked")
+            return self.retry_after
+        wait = self.limiters[route_class].allow(ip)
+        if wait:
+            self.count(f"rejected_rate_{route_class}")
+        return wait
+
+    def failed_login(self, ip):
+        self.count("failed_admin_password")
+        self.failures.allow(ip)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = self._in_flight
+        return stats
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+# Length of the content hash embedded in fingerprinted file names
+HASH_LENGTH = 10
+
+# Matches names like styles/opa.3f9a2c7d1e.css
+FINGERPRINT_PATTERN = re.compile(r"\.[0-9a-f]{%d}\.[A-Za-z0-9]+$" % HASH_LENGTH)
+
+MANIFEST_NAME = "asset-manifest.json"
+
+# Fingerprinted files no longer in the manifest, with the time they were
+# replaced. Cached pages may still refer to them, so they are kept around for
+# RETIRED_GRACE seconds before they are deleted.
+RETIRED_NAME = "asset-retired.json"
+RETIRED_GRACE = 24 * 3600
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+HTML_CACHE_CONTROL = "public, max-age=60"
+DEFAULT_CACHE_CONTROL = "public, max-age=300"
+NO_CACHE_CONTROL = "no-cache"
+
+# Always revalidated, a stale service worker would keep serving old pages
+NO_CACHE_NAMES = ("sw.js", "precache-manifest.json")
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+def fingerprinted_name(rel_path, digest):
+    root, ext = os.path.splitext(rel_path)
+    return f"{root}.{digest}{ext}"
+
+def is_fingerprinted(path):
+    return FINGERPRINT_PATTERN.search(path) is not None
+
+def cache_control_for(path):
+    if path.rsplit("/", 1)[-1] in NO_CACHE_NAMES:
+        return NO_CACHE_CONTROL
+    if is_fingerprinted(path):
+        return IMMUTABLE_CACHE_CONTROL
+    if path.endswith(".html") or path.endswith("/"):
+        return HTML_CACHE_CONTROL
+    return DEFAULT_CACHE_CONTROL
+
+def retire_stale_assets(output_path, manifest, now=None):
+    """Delete fingerprinted files that left the manifest more than RETIRED_GRACE ago.
+
+    Pages cached by browsers or the service worker still point at the
+    previous generation of hashed assets, so those stay until the grace
+    period is over.
+    """
+    now = time.time() if now is None else now
+    retired_path = os.path.join(output_path, RETIRED_NAME)
+    try:
+        with open(retired_path, "r", encoding="utf-8") as retired_file:
+            retired = json.load(retired_file)
+    except (OSError, ValueError):
+        retired = {}
+
+    live = set(manifest.values())
+    still_retired = {}
+    for root, _, files in os.walk(output_path):
+        for name in files:
+            if not is_fingerprinted(name):
+                continue
+            rel_path = os.path.relpath(os.path.join(root, name), output_path).replace(os.sep, "/")
+            if rel_path in live:
+                continue
+            since = retired.get(rel_path, now)
+            if now - since >= RETIRED_GRACE:
+                os.remove(os.path.join(root, name))
+            else:
+                still_retired[rel_path] = since
+
+    with open(retired_path, "w", encoding="utf-8") as retired_file:
+        json.dump(still_retired, retired_file, indent=2, sort_keys=True)
+
+def fingerprint_assets(output_path, rel_paths):
+    """Copy each asset under output_path to a content-hashed name.
+
+    rel_paths are URL-style paths relative to output_path. Returns a manifest
+    mapping every original path to its fingerprinted path, which is also
+    written to asset-manifest.json in the output directory.
+    """
+    manifest = {}
+    for rel_path in rel_paths:
+        full_path = os.path.join(output_path, *rel_path.split("/"))
+        if not os.path.isfile(full_path):
+            continue
+        hashed_rel_path = fingerprinted_name(rel_path, content_hash(full_path))
+        hashed_full_path = os.path.join(output_path, *hashed_rel_path.split("/"))
+        if not os.path.exists(hashed_full_path):
+            shutil.copyfile(full_path, hashed_full_path)
+        manifest[rel_path] = hashed_rel_path
+
+    with open(os.path.join(output_path, MANIFEST_NAME), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    retire_stale_assets(output_path, manifest)
+
+    return manifest
+
+def lookup_keys(url, folder=""):
+    """Keys url is looked up under, a file next to the linking page first."""
+    if folder:
+        return [f"{folder}/{url}", url]
+    return [url]
+
+def resolve_url(assets, url, folder=""):
+    for key in lookup_keys(url, folder):
+        if key in assets:
+            return assets[key]
+    return None
+
+def rewrite_asset_urls(html, assets, base="", folder=""):
+    # Point src/href attributes at the output paths of known assets and notes,
+    # relative to the page through base. folder is the page's own folder.
+    if not assets:
+        return html
+
+    def replace(match):
+        target = resolve_url(assets, match.group(2), folder)
+        if target is None:
+            return match.group(0)
+        return f'{match.group(1)}="{base}{target}"'
+
+    return re.sub(r'\b(src|href)="([^"]*)"', replace, html)
+
+def asset_url(assets, rel_path, base=""):
+    return base + (assets or {}).get(rel_path, rel_path)
+
+def load_asset_manifest(output_path):
+    manifest_path = os.path.join(output_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
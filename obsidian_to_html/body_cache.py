@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+
+from obsidian_to_html import md_html
+
+class BodyCache:
+    """Converted note bodies on disk, kept apart from the page chrome.
+
+    Bodies are stored before links are resolved and before add_styling wraps
+    them, so config or asset changes only need wrap_page again instead of a
+    full Markdown conversion. Entries are keyed by the note's mtime and size
+    and md_html.RENDER_VERSION.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, note_path):
+        name = hashlib.sha1(os.path.abspath(note_path).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{name}.json")
+
+    def _key(self, entry):
+        return [md_html.RENDER_VERSION, entry.mtime_ns, entry.size]
+
+    def get(self, entry):
+        try:
+            with open(self._path(entry.path), "r", encoding="utf-8") as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if cached.get("key") != self._key(entry):
+            return None
+        return cached["body"], cached["tags"]
+
+    def put(self, entry, body, tags):
+        path = self._path(entry.path)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as cache_file:
+            json.dump({"key": self._key(entry), "body": body, "tags": tags}, cache_file)
+        os.replace(temp_path, path)
+
+    def discard(self, note_path):
+        try:
+            os.remove(self._path(note_path))
+        except OSError:
+            pass
+
+    def prune(self, entries):
+        """Remove the bodies of every note that isn't one of entries."""
+        keep = {os.path.basename(self._path(entry.path)) for entry in entries}
+        for name in os.listdir(self.directory):
+            if name not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def render(self, entry):
+        """Return (body, tags) for entry, converting the note only on a cache miss."""
+        cached = self.get(entry)
+        if cached is not None:
+            return cached
+        body, tags = md_html.render_body(entry.path)
+        self.put(entry, body, tags)
+        return body, tags
+
+def default_cache_dir(output_path):
+    # kept one level above the output path, like booking_requests.txt, with
+    # a folder per output so sites sharing a parent don't prune each other
+    output_path = os.path.abspath(output_path)
+    return os.path.join(os.path.dirname(output_path), ".body_cache", os.path.basename(output_path))
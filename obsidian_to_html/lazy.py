@@ -0,0 +1,116 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from obsidian_to_html import md_html
+
+class LazyRenderer:
+    """Renders notes on their first request and keeps the pages in a bounded LRU.
+
+    Cached pages are keyed by the note's stat data and the config fingerprint,
+    so an edited note or config is rendered again on its next request. Every
+    render is also written through to the output directory. Concurrent
+    requests for the same page wait for a single render.
+    """
+
+    def __init__(self, output_path, store, max_bytes, body_cache=None):
+        self.output_path = output_path
+        self.store = store
+        self.body_cache = body_cache
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._size = 0
+        self._pending = {}
+        self._entries = {}
+        self._links = {}
+        self._config = None
+        self._config_key = None
+
+    def update(self, inventory, links, config, config_key):
+        """Point the renderer at the latest vault scan, assets and config."""
+        with self._lock:
+            self._entries = {entry.output: entry for entry in inventory.notes.values()}
+            # other notes' links or fingerprinted assets may have moved
+            if links != self._links or config_key != self._config_key:
+                self._cache.clear()
+                self._size = 0
+            self._links = links
+            self._config = config
+            self._config_key = config_key
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._size = 0
+
+    def discard(self, output_name):
+        with self._lock:
+            cached = self._cache.pop(output_name, None)
+            if cached is not None:
+                self._size -= len(cached[1])
+
+    def _remember(self, output_name, key, html):
+        if len(html) > self.max_bytes:
+            return
+        previous = self._cache.pop(output_name, None)
+        if previous is not None:
+            self._size -= len(previous[1])
+        self._cache[output_name] = (key, html)
+        self._size += len(html)
+        while self._size > self.max_bytes:
+            _, (_, evicted) = self._cache.popitem(last=False)
+            self._size -= len(evicted)
+
+    def get(self, output_name, count_hit=True):
+        """Return the page for output_name, or None if no note renders to it.
+
+        count_hit is off for renders that aren't page views, e.g. prerender.
+        """
+        with self._lock:
+            entry = self._entries.get(output_name)
+            if entry is None:
+                return None
+            key = (entry.source, entry.mtime_ns, entry.size, self._config_key)
+            cached = self._cache.get(output_name)
+            if cached is not None and cached[0] == key:
+                self._cache.move_to_end(output_name)
+                if count_hit:
+                    self.store.record_hit(entry.source)
+                return cached[1]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._pending[key] = future
+            links = self._links
+            config = self._config
+
+        if count_hit:
+            self.store.record_hit(entry.source)
+        if not owner:
+            return future.result()
+
+        try:
+            if self.body_cache is not None:
+                body, _ = self.body_cache.render(entry)
+            else:
+                body, _ = md_html.render_body(entry.path)
+            html = md_html.wrap_page(body, config, links, output_name, md_html.hidden_pages(self.store))
+            md_html.write_page(self.output_path, output_name, html)
+        except BaseException as e:
+            with self._lock:
+                self._pending.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._pending.pop(key, None)
+            self._remember(output_name, key, html)
+        future.set_result(html)
+        return html
+
+    def prerender(self, records):
+        for record in records:
+            # not a view, counting it would keep the eager set from changing
+            self.get(record.name, count_hit=False)
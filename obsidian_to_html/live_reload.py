@@ -0,0 +1,102 @@
+import queue
+import threading
+from urllib.parse import parse_qs, unquote, urlsplit
+
+EVENTS_PATH = "/__live-reload"
+
+# Seconds between keep-alive comments on an idle event stream
+KEEPALIVE_INTERVAL = 15
+
+# Injected into served pages in authoring mode, reloads the page as soon as
+# the server reports that it was rebuilt. %s is the site's path prefix.
+CLIENT_SCRIPT = """<script>
+(function () {
+    var source = new EventSource("%s""" + EVENTS_PATH + """?page=" + encodeURIComponent(location.pathname));
+    source.addEventListener("reload", function () { location.reload(); });
+})();
+</script>
+"""
+
+def normalize_page(url_path):
+    """Turn a request path like /travel/ into an output name like travel/index.html."""
+    page = unquote(urlsplit(url_path).path).lstrip("/")
+    if page == "" or page.endswith("/"):
+        page += "index.html"
+    return page
+
+class LiveReloadHub:
+    """Keeps one event queue per open page and pushes reload events to them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def subscribe(self, page):
+        client = queue.Queue()
+        with self._lock:
+            self._clients.setdefault(page, set()).add(client)
+        return client
+
+    def unsubscribe(self, page, client):
+        with self._lock:
+            clients = self._clients.get(page)
+            if clients is not None:
+                clients.discard(client)
+                if not clients:
+                    del self._clients[page]
+
+    def publish(self, pages):
+        """Tell clients viewing any of pages to reload, returns how many were notified."""
+        notified = 0
+        with self._lock:
+            for page in pages:
+                for client in self._clients.get(page, ()):
+                    client.put(page)
+                    notified += 1
+        return notified
+
+    def publish_all(self):
+        with self._lock:
+            pages = list(self._clients)
+        return self.publish(pages)
+
+    def stream(self, handler, prefix=""):
+        """Serve an event stream to handler until the client goes away.
+
+        prefix is the path the site is mounted under, it is stripped from the
+        page the client reports.
+        """
+        query = parse_qs(urlsplit(handler.path).query)
+        page = query.get("page", ["/"])[0]
+        if prefix and page.startswith(prefix):
+            page = page[len(prefix):]
+        page = normalize_page(page)
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Cache-Control", "no-cache")
+        handler.send_header("Connection", "keep-alive")
+        handler.end_headers()
+
+        client = self.subscribe(page)
+        try:
+            handler.wfile.write(b"retry: 500\n\n")
+            while True:
+                try:
+                    changed = client.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    handler.wfile.write(b": keep-alive\n\n")
+                    continue
+                handler.wfile.write(f"event: reload\ndata: {changed}\n\n".encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        finally:
+            self.unsubscribe(page, client)
+            handler.close_connection = True
+
+def inject_client_script(html, prefix=""):
+    script = CLIENT_SCRIPT % prefix
+    index = html.rfind("</body>")
+    if index == -1:
+        return html + script
+    return html[:index] + script + html[index:]
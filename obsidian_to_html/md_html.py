@@ -3,70 +3,174 @@ import re
 import os
 import configparser
 import shutil
+import json
+import posixpath
+from obsidian_to_html.assets import asset_url, lookup_keys, resolve_url, rewrite_asset_urls
+from obsidian_to_html.service_worker import register_script
+
+# Shared chrome files, written to the output directory by write_chrome_files
+CHROME_CSS = "styles/chrome.css"
+MATHJAX_CONFIG_JS = "scripts/mathjax-config.js"
+
+MATHJAX_CONFIG = """
+    window.MathJax = {
+        tex: {
+            inlineMath: [ ['$','$'] ],
+            displayMath: [['$$', '$$']],
+            processEscapes: true, 
+            processEnvironments: true
+        },
+        options: {
+            skipHtmlTags: ['script', 'noscript', 'style', 'textarea', 'pre']
+        }
+    };
+"""
+
+# Notes with this tag are left off the home page and never prefetched
+HIDDEN_TAG = "hidden"
+
+def generate_chrome_css(config):
+    # Layout of the title, home and impressum links, hidden on mobile
+    return f"""
+    .top-left {{
+        position: fixed;
+        left: 10px;
+        display: flex;
+        align-items: center;
+    }}
+    .top-left img {{
+        height: 50px;
+        width: 50px;
+        margin-right: 10px;
+        border-radius: 50%;
+    }}
+    .home-link {{
+        position: fixed;
+        top: 10px;
+        right: 10px;
+    }}
+    .impressum-link {{
+        position: fixed;
+        bottom: 10px;
+        left: 10px;
+    }}
+    @media only screen and (max-width: {config["style"]["mobile_width"]}px), 
+        only screen and (max-device-width: {config["style"]["mobile_width"]}px) {{
+        .top-left {{
+            display: none !important;
+        }}
+    }}
+    """
+
+def write_chrome_files(output_path, config):
+    """Write the chrome stylesheet and MathJax config shared by all pages."""
+    if not config.getboolean("build", "shared_chrome", fallback=True):
+        return []
+
+    written = []
+    for rel_path, content in ((CHROME_CSS, generate_chrome_css(config)), (MATHJAX_CONFIG_JS, MATHJAX_CONFIG)):
+        full_path = os.path.join(output_path, *rel_path.split("/"))
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w", encoding="utf-8") as chrome_file:
+            chrome_file.write(content)
+        written.append(rel_path)
+    return written
+
+def add_styling(html_content, config, assets=None, title=None, extra_head="", base=""):
+    """Wrap converted content in a full HTML document with the site chrome.
+
+    Adds MathJax support with $ for inline and $$ for display math.
+    """
+    shared_chrome = config.getboolean("build", "shared_chrome", fallback=True)
+    if title is None:
+        title = config["content"]["title"]
 
-def add_styling(html_content, config):
-    """Add MathJax support with $ for inline and $$ for display math."""
-    
     head = f"""
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{config["content"]["title"]}</title>
-    <link href="styles/github.css" rel="stylesheet">
-    <link href="styles/opa.css" rel="stylesheet">
+    <title>{title}</title>
+    <link href="{asset_url(assets, "styles/github.css", base)}" rel="stylesheet">
+    <link href="{asset_url(assets, "styles/opa.css", base)}" rel="stylesheet">
     <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.3.1/highlight.min.js"></script>
     <script>hljs.highlightAll();</script>
-    <link rel="icon" href="icon.png">
+    <link rel="icon" href="{asset_url(assets, "icon.png", base)}">
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.3/css/all.min.css">
     """
 
-    mathjax_head = """
-    <script>
-        window.MathJax = {
-            tex: {
-                inlineMath: [ ['$','$'] ],
-                displayMath: [['$$', '$$']],
-                processEscapes: true, 
-                processEnvironments: true
-            },
-            options: {
-                skipHtmlTags: ['script', 'noscript', 'style', 'textarea', 'pre']
-            }
-        };
-    </script>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/3.2.2/es5/tex-mml-chtml.js"></script>
+    if shared_chrome:
+        # Chrome styles and MathJax config live in shared, cacheable files
+        head += f"""
+    <link href="{asset_url(assets, CHROME_CSS, base)}" rel="stylesheet">
+    <script src="{asset_url(assets, MATHJAX_CONFIG_JS, base)}"></script>
     """
-    # Add title, icon and back to home link
-    logo = f'<img src="icon.png" style="height: 50px; width: 50px; margin-right: 10px; border-radius: 50%;">'
-    top_left = f"""
-    <div class="top-left" style="position: fixed; left: 10px; display: flex; align-items: center;">
-        {logo}    
+    else:
+        head += f"""
+    <style>{generate_chrome_css(config)}</style>
+    <script>{MATHJAX_CONFIG}</script>
+    """
+    head += """
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/3.2.2/es5/tex-mml-chtml.js"></script>
+    """ + extra_head
+    if config.getboolean("build", "service_worker", fallback=True):
+        head += register_script(base)
+
+    # Add title, icon, back to home and impressum links
+    chrome = f"""
+    <div class="top-left">
+        <img src="{asset_url(assets, "icon.png", base)}" alt="">
         <h1>{config["content"]["title"]}</h1>
     </div>
-    """
-
-    # Add CSS to hide top-left elements on mobile
-    style = f"""
-    <style>
-    @media only screen and (max-width: {config["style"]["mobile_width"]}px), 
-        only screen and (max-device-width: {config["style"]["mobile_width"]}px) {{
-        .top-left {{
-            display: none !important;
-        }}
-    }}
-    </style>
-    """
-    back_to_home_html = """
-    <div style="position: fixed; top: 10px; right: 10px;">
-    <a href="index.html" target="_blank"><i class="fas fa-home"></i></a>
+    <div class="home-link">
+    <a href="{base}index.html" target="_blank"><i class="fas fa-home"></i></a>
     </div>
+    <div class="impressum-link"><a href="{base}impressum.html">Impressum</a></div>
     """
-    impressum_html = '<div style="position: fixed; bottom: 10px; left: 10px;"><a href="impressum.html">Impressum</a></div>'
-    head += style + top_left + back_to_home_html + impressum_html
 
-    html = f'<head>{head}{mathjax_head}</head>\n<div class="container">{html_content}</div>'
-    
+    html = f"""<!DOCTYPE html>
+<html lang="en">
+<head>{head}</head>
+<body>{chrome}<div class="container">{html_content}</div>
+</body>
+</html>
+"""
+
+    if config.getboolean("build", "minify", fallback=False):
+        html = minify_html(html)
+
     return html
 
+# Elements whose content is whitespace sensitive and must not be minified
+PRESERVE_PATTERN = re.compile(r'<(pre|code|script|style|textarea)\b.*?</\1\s*>', re.DOTALL | re.IGNORECASE)
+TAG_PATTERN = re.compile(r'<[^>]*>')
+
+def minify_html(html):
+    """Collapse runs of whitespace outside of pre, code, script, style and textarea.
+
+    Only text between tags is touched, tags and their attribute values are
+    left as they are.
+    """
+    def collapse_text(text):
+        return re.sub(r'\s+', lambda match: "\n" if "\n" in match.group(0) else " ", text)
+
+    def collapse(html):
+        parts = []
+        position = 0
+        for match in TAG_PATTERN.finditer(html):
+            parts.append(collapse_text(html[position:match.start()]))
+            parts.append(match.group(0))
+            position = match.end()
+        parts.append(collapse_text(html[position:]))
+        return "".join(parts)
+
+    parts = []
+    position = 0
+    for match in PRESERVE_PATTERN.finditer(html):
+        parts.append(collapse(html[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(collapse(html[position:]))
+    return "".join(parts)
+
 def remove_unwanted_hashes(text):
     # Initialize an empty list to store tags
     tags = []
@@ -167,16 +271,18 @@ def replace_md_tables(text):
     
     return re.sub(pattern, replace, text)
 
+def config_file_path(config_path):
+    if config_path is not None:
+        return config_path
+    return os.path.join(os.path.dirname(__file__), "config.ini")
+
 def read_config(config_path):
     config = configparser.ConfigParser()
-    if config_path is not None:
-        config.read(config_path)
-    else:
-        config.read(os.path.join(os.path.dirname(__file__), "config.ini"))
+    config.read(config_file_path(config_path))
     
     return config
 
-def generate_opa_css(config):
+def generate_opa_css(config, output_path=None):
     css_head = f"""
     body {{
         margin: 0;
@@ -375,7 +481,10 @@ def generate_opa_css(config):
         line-height: 1.5;
     }}
     """
-    with open(os.path.join(os.path.dirname(__file__), "styles", "opa.css"), "w") as css_file:
+    # written into the output tree, sites with different configs can share the package
+    styles_dir = os.path.join(output_path or os.path.dirname(__file__), "styles")
+    os.makedirs(styles_dir, exist_ok=True)
+    with open(os.path.join(styles_dir, "opa.css"), "w") as css_file:
         css_file.write(css_head)
 
 def replace_callouts(text):
@@ -391,17 +500,22 @@ def replace_callouts(text):
     # Replace the callouts using the regular expression
     return re.sub(pattern, repl, text)
 
-def md_to_html(path, output_path=None, config_path=None):
+def read_tags(path):
+    # Tags only, without converting the note
     with open(path, "r", encoding="utf-8") as input_file:
-        text = input_file.read()
+        return remove_unwanted_hashes(input_file.read())[1]
 
-    # Read config file
-    config = read_config(config_path)
+# Bump whenever render_body's output changes, so cached bodies are redone
+RENDER_VERSION = 1
+
+def render_body(path):
+    """Convert the note at path into body HTML without the page chrome, returns (html, tags).
+
+    Links still point at vault paths, wrap_page resolves them.
+    """
+    with open(path, "r", encoding="utf-8") as input_file:
+        text = input_file.read()
 
-    # Generate style sheet opa.css
-    generate_opa_css(config)
-    copy_style_files(output_path)
-         
     # Md processing
     text, tags = remove_unwanted_hashes(text)
     text = remove_front_matter(text)
@@ -412,23 +526,119 @@ def md_to_html(path, output_path=None, config_path=None):
 
     # html processing
     html = markdown.markdown(text, extensions=["admonition"])
-    html = add_styling(html, config)
+    return html, tags
+
+def is_hidden(page):
+    # same test as isHidden in the home page script: a whole tag, any case
+    return page.has_tag(HIDDEN_TAG)
+
+def hidden_pages(store):
+    return {record.name for record in store.pages_with_tag(HIDDEN_TAG)}
+
+def link_keys(body, folder=""):
+    """Keys the local src and href values in body are looked up under."""
+    keys = set()
+    for url in re.findall(r'\b(?:src|href)="([^"]*)"', body):
+        if url and ":" not in url and not url.startswith(("#", "/")):
+            keys.update(lookup_keys(url, folder))
+    return sorted(keys)
+
+def linked_notes(body, assets, folder=""):
+    """Output names of the notes body links to, in the order they appear."""
+    targets = []
+    for url in re.findall(r'\bhref="([^"]*)"', body):
+        target = resolve_url(assets or {}, url, folder)
+        if target is not None and target.endswith(".html") and target not in targets:
+            targets.append(target)
+    return targets
+
+def prefetch_limit(config):
+    return config.getint("build", "prefetch_limit", fallback=5)
+
+# Adds <link rel="prefetch"> tags only where speculation rules aren't
+# supported, Chromium keeps the two in separate caches and would fetch twice
+PREFETCH_FALLBACK = """<script>
+    if (!(HTMLScriptElement.supports && HTMLScriptElement.supports("speculationrules"))) {
+        %s.forEach(function (url) {
+            var link = document.createElement("link");
+            link.rel = "prefetch";
+            link.href = url;
+            document.head.appendChild(link);
+        });
+    }
+    </script>"""
+
+def prefetch_hints(pages, base=""):
+    """Head tags telling the browser to fetch the likely next pages early.
+
+    Browsers with speculation rules use those, the others get
+    <link rel="prefetch"> tags instead, each URL is fetched once.
+    """
+    if not pages:
+        return ""
+    urls = [base + page for page in pages]
+    # a note name can't end the script element early
+    rules = json.dumps({"prefetch": [{"source": "list", "urls": urls}]}).replace("</", "<\\/")
+    fallback = PREFETCH_FALLBACK % json.dumps(urls).replace("</", "<\\/")
+    return f"""
+    <script type="speculationrules">{rules}</script>
+    {fallback}
+    """
+
+def wrap_page(body, config, assets=None, output_name="index.html", hidden=()):
+    # output_name is relative to the output path and may contain subfolders,
+    # links back to shared files have to climb out of them
+    base = "../" * output_name.count("/")
+    # links resolve against the note's own folder first, like in Obsidian
+    folder = posixpath.dirname(output_name)
+
+    # prefetch the first notes this one links to, hidden is the set of
+    # output names of notes that must not be prefetched
+    prefetch = [page for page in linked_notes(body, assets, folder)
+                if page != output_name and page not in hidden][:prefetch_limit(config)]
+
+    html = rewrite_asset_urls(body, assets, base, folder)
+    return add_styling(html, config, assets, extra_head=prefetch_hints(prefetch, base), base=base)
+
+def render_page(path, config, assets=None, output_name=None):
+    """Convert the note at path into a complete page, returns (html, tags)."""
+    if output_name is None:
+        output_name = f"{os.path.splitext(os.path.basename(path))[0]}.html"
+    body, tags = render_body(path)
+    return wrap_page(body, config, assets, output_name), tags
+
+def write_page(output_path, output_name, html):
+    output = os.path.join(output_path, *output_name.split("/"))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    # save html file
+    with open(output, "w", encoding="utf-8", errors="xmlcharrefreplace") as output_file:
+        output_file.write(html)
+
+def md_to_html(path, output_path=None, config_path=None, assets=None, output_name=None, config=None):
+    # Read config file
+    if config is None:
+        config = read_config(config_path)
+
+    # Generate style sheet opa.css, unless the caller already built the assets
+    if assets is None:
+        copy_style_files(output_path)
+        generate_opa_css(config, output_path)
+        write_chrome_files(output_path, config)
+
+    if output_name is None:
+        output_name = f"{os.path.splitext(os.path.basename(path))[0]}.html"
+    html, tags = render_page(path, config, assets, output_name)
 
-    md_file_name = path.split(os.sep)[-1]
     if output_path is not None:
-        output = f"{output_path}{os.sep}{md_file_name.split('.')[0]}.html"
-        # save html file
-        with open(output, "w", encoding="utf-8", errors="xmlcharrefreplace") as output_file:
-            output_file.write(html)
-        
-        return f"{md_file_name.split('.')[0]}.html", tags
+        write_page(output_path, output_name, html)
+        return output_name, tags
 
-    output = f"{path.split(".")[0]}.html"
+    output = f"{os.path.splitext(path)[0]}.html"
     # save html file
     with open(output, "w", encoding="utf-8", errors="xmlcharrefreplace") as output_file:
         output_file.write(html)
         
-    return f"{md_file_name.split('.')[0]}.html", tags
+    return output_name, tags
 
 
 def copy_style_files(output_path):
@@ -447,11 +657,13 @@ def copy_style_files(output_path):
         if os.path.isfile(full_file_name):
             shutil.copy(full_file_name, dest_dir)
 
-def generate_home_page(pages: list, output_path, config_path=None):
+def generate_home_page(pages: list, output_path, config_path=None, assets=None):
     # config file
     config = read_config(config_path)
-    generate_opa_css(config)
-    copy_style_files(output_path)
+    if assets is None:
+        copy_style_files(output_path)
+        generate_opa_css(config, output_path)
+        write_chrome_files(output_path, config)
     
     # Define the home page content
     home_page_content = f"""
@@ -476,16 +688,14 @@ def generate_home_page(pages: list, output_path, config_path=None):
     # Add page cards to the home page content
     for page in pages:
         # Generate tags HTML if page has tags
-        tags_html = ""
-        if "tags" in page:
-            tags_html = "".join([f'<span class="tag">{tag}</span>' for tag in page["tags"]])
+        tags_html = "".join([f'<span class="tag">{tag}</span>' for tag in page.tags])
         
         # Generate the page card
         home_page_content += f"""
         <div class="page-card">
             <div class="page-info">
-                <a href="{page["name"]}">{page["name"].replace('.html', '')}</a>
-                <span class="date">{page["date"]}</span>
+                <a href="{page.name}">{page.name.replace('.html', '')}</a>
+                <span class="date">{page.date}</span>
             </div>
             <div class="tags">
                 {tags_html}
@@ -497,13 +707,20 @@ def generate_home_page(pages: list, output_path, config_path=None):
 
     home_page_content += """
     <script>
+        // a card is hidden if one of its tags is exactly "hidden", in any case
+        function isHidden(card) {
+            for (let tag of card.querySelectorAll('span.tag')) {
+                if (tag.textContent.toLowerCase() === 'hidden') {
+                    return true;
+                }
+            }
+            return false;
+        }
         document.addEventListener('DOMContentLoaded', function() {
         let cards = document.getElementsByClassName('page-card');
         
         for (let card of cards) {
-            let tags = card.querySelector('div.tags').textContent.toLowerCase();
-            
-            if (tags.includes('hidden')) {
+            if (isHidden(card)) {
                 card.style.display = "none";
             }
         }
@@ -517,7 +734,7 @@ def generate_home_page(pages: list, output_path, config_path=None):
                 let tags = card.querySelector('div.tags').textContent.toLowerCase();
                 let date = card.querySelector('span.date').textContent.toLowerCase();
                 
-                if (tags.includes('hidden')) {
+                if (isHidden(card)) {
                     card.style.display = "none";
                 } else if (title.includes(input) || tags.includes(input) || date.includes(input)) {
                     card.style.display = "";
@@ -538,42 +755,38 @@ def generate_home_page(pages: list, output_path, config_path=None):
         }
     </style>
     """
-    # Add styling to the home page content
-    home_page = add_styling(home_page_content, config)
+    # Add styling to the home page content, prefetching the newest visible notes
+    prefetch = [page.name for page in pages if not is_hidden(page)][:prefetch_limit(config)]
+    home_page = add_styling(home_page_content, config, assets, extra_head=prefetch_hints(prefetch))
 
     # save home page
     with open(f"{output_path}{os.sep}index.html", "w", encoding="utf-8", errors="xmlcharrefreplace") as output_file:
         output_file.write(home_page)
     
     # generate impressum
-    generate_impressum(output_path, config_path)
+    generate_impressum(output_path, config_path, assets)
 
-def generate_impressum(output_path, config_path=None):
+def generate_impressum(output_path, config_path=None, assets=None):
     # Read the config file
     config = read_config(config_path)
     
+    impressum_style = """
+    <style>
+        .impressum {
+            font-family: Arial, sans-serif;
+            line-height: 1.6;
+        }
+        .impressum h1 {
+            font-size: 24px;
+        }
+        .impressum p {
+            margin: 10px 0;
+        }
+    </style>
+    """
+
     impressum = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Impressum</title>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                margin: 20px;
-                line-height: 1.6;
-            }}
-            h1 {{
-                font-size: 24px;
-            }}
-            p {{
-                margin: 10px 0;
-            }}
-        </style>
-    </head>
-    <body>
+    <div class="impressum">
         <h1>Impressum</h1>
         <p><strong>Name:</strong>{config["content"]["name"]}</p>
         <p><strong>Address:</strong> {config["content"]["address"]}</p>
@@ -581,12 +794,11 @@ def generate_impressum(output_path, config_path=None):
         <h2>Disclaimer</h2>
         <p>All information on this website is provided for general information purposes only. I do not take responsibility for the accuracy, completeness, or timeliness of the information provided.</p>
         <p>Despite careful control, I assume no liability for the content of external links. The operators of the linked pages are solely responsible for their content.</p>
-    </body>
-    </html>
+    </div>
     """
 
     # Add styling to the impressum content
-    impressum = add_styling(impressum, config)
+    impressum = add_styling(impressum, config, assets, title="Impressum", extra_head=impressum_style)
 
     # Save the impressum file
     with open(f"{output_path}{os.sep}impressum.html", "w", encoding="utf-8", errors="xmlcharrefreplace") as output_file:
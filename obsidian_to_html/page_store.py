@@ -0,0 +1,203 @@
+import sqlite3
+import threading
+import time
+
+class PageRecord:
+    """Metadata of one converted note.
+
+    links are the keys the note's links are looked up under in the link map,
+    see assets.lookup_keys.
+    """
+
+    __slots__ = ("source", "name", "tags", "time", "mtime_ns", "size", "links")
+
+    def __init__(self, source, name, tags, time, mtime_ns, size, links=()):
+        self.source = source
+        self.name = name
+        self.tags = tuple(tags)
+        self.time = time
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.links = tuple(links)
+
+    @property
+    def date(self):
+        return time.strftime('%d.%m.%Y', time.localtime(self.time))
+
+    def has_tag(self, tag):
+        # tags match case-insensitively, like the home page filter
+        return tag.lower() in (own.lower() for own in self.tags)
+
+class PageStore:
+    """Page metadata shared by the home page, tag listings and change detection.
+
+    Records live in memory and are updated in place as notes change. If a
+    db_path is given they are also persisted to SQLite, so a restarted server
+    can pick up where it left off instead of re-reading every note.
+    """
+
+    def __init__(self, db_path=None):
+        self.lock = threading.RLock()
+        self._records = {}
+        self._tag_index = {}
+        self._link_index = {}
+        self._sorted = None
+        self._hits = {}
+        self._dirty_hits = set()
+        self._meta = {}
+        self._db = None
+
+        if db_path is not None:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "source TEXT PRIMARY KEY, name TEXT, tags TEXT, "
+                "time REAL, mtime_ns INTEGER, size INTEGER)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(pages)")]
+            if "links" not in columns:
+                # dbs written before links were tracked
+                self._db.execute("ALTER TABLE pages ADD COLUMN links TEXT DEFAULT ''")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS hits (source TEXT PRIMARY KEY, count INTEGER)")
+            for source, name, tags, ctime, mtime_ns, size, links in self._db.execute(
+                    "SELECT source, name, tags, time, mtime_ns, size, links FROM pages"):
+                self._add(PageRecord(source, name, tags.split() if tags else (), ctime, mtime_ns, size,
+                                     links.split("\n") if links else ()))
+            self._hits = dict(self._db.execute("SELECT source, count FROM hits"))
+            self._meta = dict(self._db.execute("SELECT key, value FROM meta"))
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(list(self._records.values()))
+
+    def __contains__(self, source):
+        return source in self._records
+
+    def get(self, source):
+        return self._records.get(source)
+
+    def sources(self):
+        return list(self._records)
+
+    def _add(self, record):
+        self._records[record.source] = record
+        for tag in record.tags:
+            self._tag_index.setdefault(tag.lower(), set()).add(record.source)
+        for key in record.links:
+            self._link_index.setdefault(key, set()).add(record.source)
+
+    def _discard(self, source):
+        record = self._records.pop(source, None)
+        if record is None:
+            return None
+        for tag in record.tags:
+            sources = self._tag_index.get(tag.lower())
+            if sources is not None:
+                sources.discard(source)
+                if not sources:
+                    del self._tag_index[tag.lower()]
+        for key in record.links:
+            sources = self._link_index.get(key)
+            if sources is not None:
+                sources.discard(source)
+                if not sources:
+                    del self._link_index[key]
+        return record
+
+    def upsert(self, record):
+        with self.lock:
+            self._discard(record.source)
+            self._add(record)
+            self._sorted = None
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO pages (source, name, tags, time, mtime_ns, size, links) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (record.source, record.name, " ".join(record.tags),
+                     record.time, record.mtime_ns, record.size, "\n".join(record.links)),
+                )
+
+    def remove(self, source):
+        with self.lock:
+            record = self._discard(source)
+            self._sorted = None
+            self._hits.pop(source, None)
+            self._dirty_hits.discard(source)
+            if self._db is not None:
+                self._db.execute("DELETE FROM pages WHERE source = ?", (source,))
+                self._db.execute("DELETE FROM hits WHERE source = ?", (source,))
+            return record
+
+    def commit(self):
+        if self._db is not None:
+            with self.lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO hits VALUES (?, ?)",
+                    [(source, self._hits[source]) for source in self._dirty_hits if source in self._hits],
+                )
+                self._dirty_hits.clear()
+                self._db.commit()
+
+    def record_hit(self, source):
+        with self.lock:
+            self._hits[source] = self._hits.get(source, 0) + 1
+            self._dirty_hits.add(source)
+
+    def popular(self, count):
+        """Return up to count records, most viewed first."""
+        with self.lock:
+            sources = sorted((source for source in self._hits if source in self._records),
+                             key=lambda source: self._hits[source], reverse=True)
+            return [self._records[source] for source in sources[:count]]
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            return self._meta.get(key, default)
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self._meta[key] = value
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def sorted_pages(self):
+        """Return all records, most recent first."""
+        with self.lock:
+            if self._sorted is None:
+                self._sorted = sorted(self._records.values(), key=lambda record: record.time, reverse=True)
+            return self._sorted
+
+    def pages_with_tag(self, tag):
+        with self.lock:
+            sources = self._tag_index.get(tag.lower(), ())
+            return sorted((self._records[source] for source in sources),
+                          key=lambda record: record.time, reverse=True)
+
+    def linking_to(self, keys):
+        """Sources of the notes that link through any of keys."""
+        with self.lock:
+            sources = set()
+            for key in keys:
+                sources.update(self._link_index.get(key, ()))
+            return sources
+
+    def changes(self, stats):
+        """Compare current file stats against the stored records.
+
+        stats maps each source to its (mtime_ns, size). Returns the lists of
+        added, modified and deleted sources.
+        """
+        with self.lock:
+            added = []
+            modified = []
+            for source, (mtime_ns, size) in stats.items():
+                record = self._records.get(source)
+                if record is None:
+                    added.append(source)
+                elif record.mtime_ns != mtime_ns or record.size != size:
+                    modified.append(source)
+            deleted = [source for source in self._records if source not in stats]
+        return added, modified, deleted
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+
+from obsidian_to_html.assets import HASH_LENGTH, content_hash, is_fingerprinted
+from obsidian_to_html.live_reload import EVENTS_PATH
+
+SW_NAME = "sw.js"
+PRECACHE_MANIFEST = "precache-manifest.json"
+
+# Folders whose files are always precached, besides icon.png and index.html
+PRECACHE_DIRS = ("styles", "scripts")
+
+# Installs only the entries whose hash changed since the last build, then
+# answers same-origin GETs from the cache and refreshes them in the background.
+# Live reload streams and admin routes always go to the network.
+SW_TEMPLATE = """const VERSION = "%(version)s";
+const PRECACHE = %(entries)s;
+// one cache per site, several sites can share an origin
+const CACHE = "obsidian-to-html:" + self.registration.scope;
+const HASHES = "__precache-hashes";
+
+function resolve(url) {
+    return new URL(url, self.registration.scope).href;
+}
+
+self.addEventListener("install", function (event) {
+    event.waitUntil((async function () {
+        const cache = await caches.open(CACHE);
+        const stored = await cache.match(resolve(HASHES));
+        const previous = stored ? await stored.json() : {};
+        const changed = Object.keys(PRECACHE).filter(function (url) { return previous[url] !== PRECACHE[url]; });
+        await Promise.all(changed.map(async function (url) {
+            const response = await fetch(resolve(url), {cache: "no-cache", headers: {"Purpose": "prefetch"}});
+            if (response.status === 200) {
+                await cache.put(resolve(url), response);
+            }
+        }));
+        await self.skipWaiting();
+    })());
+});
+
+self.addEventListener("activate", function (event) {
+    event.waitUntil((async function () {
+        const cache = await caches.open(CACHE);
+        const stored = await cache.match(resolve(HASHES));
+        const previous = stored ? await stored.json() : {};
+        await Promise.all(Object.keys(previous).filter(function (url) { return !(url in PRECACHE); })
+            .map(function (url) { return cache.delete(resolve(url)); }));
+        await cache.put(resolve(HASHES), new Response(JSON.stringify(PRECACHE)));
+        await self.clients.claim();
+    })());
+});
+
+self.addEventListener("fetch", function (event) {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (request.method !== "GET" || request.headers.has("range") || !request.url.startsWith(self.registration.scope)
+            || url.pathname.endsWith("%(events_path)s") || url.pathname.includes("-pw:")) {
+        return;
+    }
+    event.respondWith((async function () {
+        const cache = await caches.open(CACHE);
+        // a folder is served from its index.html, which is what got precached
+        const key = url.pathname.endsWith("/") ? new URL("index.html", url).href : request;
+        const cached = await cache.match(key);
+        const network = fetch(request).then(function (response) {
+            if (response.status === 200) {
+                cache.put(key, response.clone());
+            }
+            return response;
+        });
+        if (cached) {
+            event.waitUntil(network.catch(function () {}));
+            return cached;
+        }
+        return network;
+    })());
+});
+"""
+
+# Served instead of the real worker in authoring mode, so pages always come
+# from the server
+UNREGISTER_SCRIPT = """self.addEventListener("install", function () { self.skipWaiting(); });
+self.addEventListener("activate", function (event) {
+    event.waitUntil(caches.delete("obsidian-to-html:" + self.registration.scope).then(function () { return self.registration.unregister(); }));
+});
+"""
+
+def register_script(base=""):
+    return f"""
+    <script>if ("serviceWorker" in navigator) navigator.serviceWorker.register("{base}{SW_NAME}");</script>
+    """
+
+def precache_urls(output_path, assets, pages):
+    """URLs to precache: the home page, stylesheets, scripts, icon and pages.
+
+    assets maps plain asset paths to their fingerprinted names, only the
+    fingerprinted copy of a file is listed.
+    """
+    assets = assets or {}
+    urls = ["index.html", "impressum.html", assets.get("icon.png", "icon.png")]
+    for directory in PRECACHE_DIRS:
+        full_directory = os.path.join(output_path, directory)
+        if not os.path.isdir(full_directory):
+            continue
+        for name in sorted(os.listdir(full_directory)):
+            if not is_fingerprinted(name):
+                rel_path = f"{directory}/{name}"
+                urls.append(assets.get(rel_path, rel_path))
+    for page in pages:
+        if page not in urls:
+            urls.append(page)
+    return urls
+
+def write_service_worker(output_path, urls):
+    """Write sw.js and the precache manifest for urls, returns the version.
+
+    Each entry maps a URL to the hash of its content, files that don't exist
+    (e.g. unrendered notes in lazy mode) are left out. sw.js is only
+    rewritten when an entry changed, so browsers reinstall it only then.
+    """
+    entries = {}
+    for url in urls:
+        path = os.path.join(output_path, *url.split("/"))
+        if os.path.isfile(path):
+            entries[url] = content_hash(path)
+    entries_json = json.dumps(entries, indent=2, sort_keys=True)
+    version = hashlib.sha256(entries_json.encode("utf-8")).hexdigest()[:HASH_LENGTH]
+
+    with open(os.path.join(output_path, PRECACHE_MANIFEST), "w", encoding="utf-8") as manifest_file:
+        json.dump({"version": version, "entries": entries}, manifest_file, indent=2, sort_keys=True)
+
+    script = SW_TEMPLATE % {"version": version, "entries": entries_json, "events_path": EVENTS_PATH}
+    sw_path = os.path.join(output_path, SW_NAME)
+    if os.path.exists(sw_path):
+        with open(sw_path, "r", encoding="utf-8") as sw_file:
+            if sw_file.read() == script:
+                return version
+    with open(sw_path, "w", encoding="utf-8") as sw_file:
+        sw_file.write(script)
+    return version
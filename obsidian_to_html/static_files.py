@@ -0,0 +1,219 @@
+import email.utils
+import mimetypes
+import os
+import posixpath
+import uuid
+
+# Bodies at least this large are handed to the kernel with sendfile instead of
+# being copied through Python buffers
+SENDFILE_THRESHOLD = 64 * 1024
+
+# More ranges than this in one request are answered with the full file
+MAX_RANGES = 16
+
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".htm": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".json": "application/json",
+    ".txt": "text/plain; charset=utf-8",
+    ".md": "text/markdown; charset=utf-8",
+    ".xml": "application/xml",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
+    ".svg": "image/svg+xml",
+    ".ico": "image/x-icon",
+    ".pdf": "application/pdf",
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".ogg": "audio/ogg",
+    ".mp4": "video/mp4",
+    ".webm": "video/webm",
+    ".woff": "font/woff",
+    ".woff2": "font/woff2",
+}
+
+def guess_content_type(path):
+    ext = posixpath.splitext(path)[1].lower()
+    if ext in CONTENT_TYPES:
+        return CONTENT_TYPES[ext]
+    guessed, _ = mimetypes.guess_type(path)
+    return guessed or "application/octet-stream"
+
+def parse_range_header(header, size):
+    """Parse a Range header into sorted, merged (start, end) byte ranges.
+
+    Returns None if the header is malformed or should be ignored, and an
+    empty list if none of the requested ranges can be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    parts = spec.split(",")
+    if len(parts) > MAX_RANGES:
+        return None
+    for part in parts:
+        first, sep, last = part.strip().partition("-")
+        if not sep:
+            return None
+        first, last = first.strip(), last.strip()
+        try:
+            if not first:
+                # suffix range: the last n bytes
+                length = int(last)
+                # nothing to serve from an empty file, answered with a 416
+                if length <= 0 or size == 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            start = int(first)
+            end = int(last) if last else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start >= size:
+            continue
+        if end is None:
+            end = size - 1
+        ranges.append((start, min(end, size - 1)))
+
+    # Merge overlapping and adjacent ranges
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _not_modified(headers, etag, mtime):
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+        if since is None:
+            return False
+        return int(mtime) <= since.timestamp()
+    return False
+
+def _if_range_matches(if_range, etag, last_modified):
+    # Without If-Range the Range header always applies
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    return if_range == last_modified
+
+def _copy_range(handler, file, offset, count):
+    if count >= SENDFILE_THRESHOLD:
+        # socket.sendfile uses os.sendfile where available and falls back to
+        # send() otherwise, e.g. on TLS sockets
+        handler.connection.sendfile(file, offset, count)
+    else:
+        file.seek(offset)
+        handler.wfile.write(file.read(count))
+
+def send_static_file(handler, fs_path, head_only=False, extra_headers=None):
+    try:
+        file = open(fs_path, "rb")
+    except OSError:
+        handler.send_error(404, "File not found")
+        return
+
+    with file:
+        stat = os.fstat(file.fileno())
+        size = stat.st_size
+        content_type = guess_content_type(fs_path)
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+
+        def send_common_headers():
+            handler.send_header("Accept-Ranges", "bytes")
+            handler.send_header("Last-Modified", last_modified)
+            handler.send_header("ETag", etag)
+            for key, value in (extra_headers or {}).items():
+                handler.send_header(key, value)
+
+        if _not_modified(handler.headers, etag, stat.st_mtime):
+            handler.send_response(304)
+            send_common_headers()
+            handler.end_headers()
+            return
+
+        ranges = None
+        range_header = handler.headers.get("Range")
+        if range_header and _if_range_matches(handler.headers.get("If-Range"), etag, last_modified):
+            ranges = parse_range_header(range_header, size)
+
+        if ranges == []:
+            handler.send_response(416)
+            handler.send_header("Content-Range", f"bytes */{size}")
+            handler.send_header("Content-Length", "0")
+            send_common_headers()
+            handler.end_headers()
+            return
+
+        if not ranges:
+            handler.send_response(200)
+            handler.send_header("Content-Type", content_type)
+            handler.send_header("Content-Length", str(size))
+            send_common_headers()
+            handler.end_headers()
+            if not head_only and size:
+                _copy_range(handler, file, 0, size)
+            return
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            handler.send_response(206)
+            handler.send_header("Content-Type", content_type)
+            handler.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            handler.send_header("Content-Length", str(end - start + 1))
+            send_common_headers()
+            handler.end_headers()
+            if not head_only:
+                _copy_range(handler, file, start, end - start + 1)
+            return
+
+        # Several ranges are sent as a multipart/byteranges body
+        boundary = uuid.uuid4().hex
+        part_heads = [
+            (f"--{boundary}\r\n"
+             f"Content-Type: {content_type}\r\n"
+             f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode("latin-1")
+            for start, end in ranges
+        ]
+        closing = f"--{boundary}--\r\n".encode("latin-1")
+        content_length = len(closing) + sum(
+            len(part_head) + (end - start + 1) + 2
+            for part_head, (start, end) in zip(part_heads, ranges)
+        )
+
+        handler.send_response(206)
+        handler.send_header("Content-Type", f"multipart/byteranges; boundary={boundary}")
+        handler.send_header("Content-Length", str(content_length))
+        send_common_headers()
+        handler.end_headers()
+        if head_only:
+            return
+        for part_head, (start, end) in zip(part_heads, ranges):
+            handler.wfile.write(part_head)
+            _copy_range(handler, file, start, end - start + 1)
+            handler.wfile.write(b"\r\n")
+        handler.wfile.write(closing)
@@ -0,0 +1,127 @@
+import os
+import posixpath
+
+NOTE = "note"
+IMAGE = "image"
+ATTACHMENT = "attachment"
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg")
+
+# Everything below this vault folder is published as-is
+ATTACHMENTS_DIR = "pages"
+
+def link_names(source, kind):
+    """The ways a note can refer to the file at source: its vault path, its
+    file name and, for notes, both without .md."""
+    names = [source, posixpath.basename(source)]
+    if kind == NOTE:
+        names += [posixpath.splitext(name)[0] for name in names]
+    return names
+
+class VaultEntry:
+    """One file found in the vault, with the stat data the build needs."""
+
+    __slots__ = ("kind", "source", "path", "mtime_ns", "size", "ctime")
+
+    def __init__(self, kind, source, path, stat_result):
+        self.kind = kind
+        # URL-style path relative to the vault root, e.g. "travel/japan.md"
+        self.source = source
+        self.path = path
+        self.mtime_ns = stat_result.st_mtime_ns
+        self.size = stat_result.st_size
+        self.ctime = stat_result.st_ctime
+
+    @property
+    def output(self):
+        """Path of the emitted file relative to the output directory."""
+        if self.kind == NOTE:
+            return posixpath.splitext(self.source)[0] + ".html"
+        return self.source
+
+    @property
+    def stat_key(self):
+        return self.mtime_ns, self.size
+
+class VaultInventory:
+    """Notes, images and attachments of a vault, keyed by their source path."""
+
+    def __init__(self, root):
+        self.root = root
+        self.notes = {}
+        self.images = {}
+        self.attachments = {}
+
+    def add(self, entry):
+        {NOTE: self.notes, IMAGE: self.images, ATTACHMENT: self.attachments}[entry.kind][entry.source] = entry
+
+    def note_stats(self):
+        return {source: entry.stat_key for source, entry in self.notes.items()}
+
+    def file_stats(self):
+        """Stats of everything that is copied rather than converted."""
+        stats = {source: entry.stat_key for source, entry in self.images.items()}
+        stats.update((source, entry.stat_key) for source, entry in self.attachments.items())
+        return stats
+
+    def link_targets(self, manifest=None):
+        """Map the ways a note can refer to a file onto its output path.
+
+        Obsidian resolves [[name]] and ![[image.png]] anywhere in the vault, so
+        besides full vault paths, bare file names (and note names without .md)
+        are mapped too. If two files share a name, the shallowest one wins
+        here; wrap_page tries the linking note's own folder before this map.
+        Fingerprinted names from manifest take precedence over plain ones.
+        """
+        manifest = manifest or {}
+        targets = dict(manifest)
+        entries = sorted(list(self.notes.values()) + list(self.images.values()),
+                         key=lambda entry: (entry.source.count("/"), entry.source))
+        for entry in entries:
+            target = manifest.get(entry.output, entry.output)
+            for name in link_names(entry.source, entry.kind):
+                targets.setdefault(name, target)
+        return targets
+
+def classify(source):
+    if source.split("/", 1)[0] == ATTACHMENTS_DIR:
+        return ATTACHMENT
+    lower = source.lower()
+    if lower.endswith(".md"):
+        return NOTE
+    if lower.endswith(IMAGE_EXTENSIONS):
+        return IMAGE
+    return None
+
+def scan_vault(root):
+    """Walk the vault once with os.scandir and return its inventory.
+
+    Hidden files and folders such as .obsidian and .trash are skipped, and
+    files that are neither notes, images nor under pages/ are left out.
+    """
+    inventory = VaultInventory(root)
+    pending = [(root, "")]
+    while pending:
+        directory, prefix = pending.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for dir_entry in entries:
+            if dir_entry.name.startswith("."):
+                continue
+            source = prefix + dir_entry.name
+            if dir_entry.is_dir():
+                pending.append((dir_entry.path, source + "/"))
+                continue
+            if not dir_entry.is_file():
+                continue
+            kind = classify(source)
+            if kind is None:
+                continue
+            try:
+                stat_result = dir_entry.stat()
+            except OSError:
+                continue
+            inventory.add(VaultEntry(kind, source, dir_entry.path, stat_result))
+    return inventory